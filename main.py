@@ -1,16 +1,27 @@
+import asyncio
+import hashlib
+import hmac
 import os
 import secrets
+import sqlite3
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Optional, List
-from sqlalchemy.orm import selectinload # Add this import
+from sqlalchemy import Index, bindparam, event, text, tuple_, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload, raiseload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import jwt
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlmodel import SQLModel, Field, Relationship, Session, create_engine, select
-import shutil
+from pydantic import field_serializer, field_validator
+from sqlmodel import SQLModel, Field, Relationship, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from pathlib import Path
 
 # --- BACKUP CONFIG ---
@@ -19,21 +30,65 @@ BACKUP_DIR.mkdir(exist_ok=True) # Creates the folder if it doesn't exist
 
 def create_db_backup():
     if os.path.exists(sqlite_file_name):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = BACKUP_DIR / f"database_backup_{timestamp}.db"
-        shutil.copy2(sqlite_file_name, backup_path)
+        now = datetime.now()
+        # One backup per day is enough; restarts on the same day reuse it
+        if any(BACKUP_DIR.glob(f"database_backup_{now:%Y%m%d}_*.db")):
+            return
+        backup_path = BACKUP_DIR / f"database_backup_{now:%Y%m%d_%H%M%S}.db"
+        # Write under a temp name so a failed backup never counts as today's backup
+        tmp_path = backup_path.with_suffix(".db.tmp")
+        # SQLite's online backup API gives a consistent copy even with WAL writes in flight
+        src = sqlite3.connect(sqlite_file_name)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        tmp_path.replace(backup_path)
         print(f"✅ Database backup created: {backup_path}")
 
 load_dotenv()
 
 # --- SQL CONFIG ---
 sqlite_file_name = "database.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
 connect_args = {"check_same_thread": False} # Needed for SQLite
-engine = create_engine(sqlite_url, connect_args=connect_args)
+# Keep a small pool of warm connections instead of reopening the file per request.
+# Default size follows the usual (cores * 2) + spindles rule of thumb.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", (os.cpu_count() or 2) * 2 + 1))
+engine = create_async_engine(
+    sqlite_url,
+    connect_args=connect_args,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=POOL_SIZE,
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+)
 
-def get_session():
-    with Session(engine) as session:
+# Runs once per new pooled connection: WAL lets readers and writers overlap,
+# and the larger cache / mmap keep hot pages in memory.
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+# expire_on_commit=False so returned models don't trigger lazy reloads outside the loop
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def get_session():
+    async with async_session() as session:
         yield session
 
 
@@ -43,23 +98,54 @@ class SubTaskBase(SQLModel):
 
 class SubTask(SubTaskBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    todo_id: Optional[int] = Field(default=None, foreign_key="todo.id")
+    # SQLite doesn't index foreign keys on its own; subtask loads filter on this column
+    todo_id: Optional[int] = Field(default=None, foreign_key="todo.id", index=True)
     # Link back to Todo (internal use)
     todo: Optional["Todo"] = Relationship(back_populates="subTasks")
 
 class SubTaskRead(SubTaskBase):
     id: int
 
+def to_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    # dueDate is stored without an offset and always means UTC (shared with migrate.py)
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def parse_due_date(raw: Optional[str]) -> Optional[datetime]:
+    # Older data stored dueDate as free-form ISO-8601 text (sometimes with a trailing 'Z', or "")
+    if not raw:
+        return None
+    return to_utc_naive(datetime.fromisoformat(raw.replace('Z', '+00:00')))
+
 class TodoBase(SQLModel):
     task: str
     completed: bool = False
     priority: str = "Medium"
-    dueDate: Optional[str] = None
+    # Stored as a real datetime so "due before X" queries can use the index
+    dueDate: Optional[datetime] = Field(default=None, index=True)
     remindMe: bool = False
 
+    @field_validator("dueDate", mode="before")
+    @classmethod
+    def blank_due_date(cls, value):
+        # Clients used to send "" for "no due date" when this was a text column
+        return None if value == "" else value
+
+    @field_validator("dueDate")
+    @classmethod
+    def due_date_to_utc(cls, value):
+        return to_utc_naive(value)
+
+    @field_serializer("dueDate")
+    def serialize_due_date(self, value: Optional[datetime]):
+        # Send it back marked as UTC so clients don't read it as local time
+        return value.replace(tzinfo=timezone.utc) if value is not None else None
+
 # A plain model for incoming subtask data
 class SubTaskCreate(SubTaskBase):
-    pass
+    # Set when editing an existing subtask so update_todo can change it in place
+    id: Optional[int] = None
 
 class TodoCreate(TodoBase):
     # This uses the plain SubTaskCreate list, not the DB Table list
@@ -84,9 +170,16 @@ class TodoRead(TodoBase):
     # This is the "Magic" line that forces the subTasks into the JSON
     subTasks: List[SubTaskRead] = []
 
+def new_log_id() -> str:
+    # 8 hex chars straight from os.urandom, no UUID formatting + slicing
+    return secrets.token_hex(4)
+
 class LogEntry(SQLModel, table=True):
+    # Matches the (timestamp, id) ordering used by GET /logs
+    __table_args__ = (Index("ix_logentry_timestamp_id", "timestamp", "id"),)
+
     id: str = Field(
-        default_factory=lambda: str(uuid.uuid4())[:8],
+        default_factory=new_log_id,
         primary_key=True
     )
     message: str
@@ -94,20 +187,97 @@ class LogEntry(SQLModel, table=True):
     url: Optional[str] = Field(default="Unknown URL")
     timestamp: datetime = Field(default_factory=datetime.now)
 
+EXISTING_DB_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_subtask_todo_id ON subtask (todo_id)",
+    'CREATE INDEX IF NOT EXISTS "ix_todo_dueDate" ON todo ("dueDate")',
+    "CREATE INDEX IF NOT EXISTS ix_logentry_timestamp_id ON logentry (timestamp, id)",
+]
+
+# dueDate used to be a text column: anything not already in SQLAlchemy's DateTime text format
+# (YYYY-MM-DD HH:MM:SS.ffffff) would fail to load, or load with the time silently dropped
+LEGACY_DUE_DATES_SELECT = text(
+    'SELECT id, CAST("dueDate" AS TEXT) FROM todo WHERE "dueDate" IS NOT NULL AND "dueDate" NOT GLOB '
+    "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]'"
+)
+LEGACY_DUE_DATES_UPDATE = update(Todo.__table__).where(Todo.id == bindparam("todo_id")).values(dueDate=bindparam("due"))
+
+async def convert_legacy_due_dates(conn):
+    rows = (await conn.execute(LEGACY_DUE_DATES_SELECT)).all()
+    if not rows:
+        return
+    updates = []
+    for todo_id, raw in rows:
+        try:
+            due = parse_due_date(raw)
+        except ValueError:
+            print(f"Clearing unparseable dueDate on todo {todo_id}: {raw!r}")
+            due = None
+        updates.append({"todo_id": todo_id, "due": due})
+    await conn.execute(LEGACY_DUE_DATES_UPDATE, updates)
+    print(f"✅ Converted {len(updates)} legacy due dates")
+
+# --- STATEMENTS ---
+# Built once at import; handlers only add their page limit/cursor on top.
+# Todos only carry a handful of subtasks, so one LEFT JOIN beats a second IN-list query.
+# raiseload("*") makes any relationship we forgot to eager-load fail loudly instead of N+1
+TODOS_STMT = select(Todo).options(joinedload(Todo.subTasks), raiseload("*")).order_by(Todo.id)
+# Log ids are random, so page newest-first on (timestamp, id) and use the id only as the cursor
+LOGS_STMT = select(LogEntry).options(raiseload("*")).order_by(LogEntry.timestamp.desc(), LogEntry.id.desc())
+# Single todo with its subtasks in one round-trip (session.get + lazy="selectin" takes two)
+TODO_BY_ID_STMT = select(Todo).where(Todo.id == bindparam("todo_id")).options(joinedload(Todo.subTasks))
+# Doesn't touch objects already in the session; update_todo takes the deleted rows out itself
+SUBTASKS_DELETE_STMT = (
+    delete(SubTask)
+    .where(SubTask.id.in_(bindparam("ids", expanding=True)))
+    .execution_options(synchronize_session=False)
+)
+
 # --- APP INITIALIZATION ---
 app = FastAPI()
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    global log_queue, log_writer_task
     create_db_backup()
-    SQLModel.metadata.create_all(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        # create_all skips indexes on tables that already exist, so add them for older databases
+        for statement in EXISTING_DB_INDEXES:
+            await conn.execute(text(statement))
+        await convert_legacy_due_dates(conn)
+    log_queue = asyncio.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    log_writer_task = asyncio.create_task(log_writer())
+    log_writer_task.add_done_callback(report_log_writer_exit)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Ask the writer to stop after committing its current batch, then flush anything left over.
+    # Never block on a full queue: if the writer has died nothing will ever make room.
+    pending = []
+    if not log_writer_task.done():
+        if log_queue.full():
+            # Take the backlog ourselves to make room for the stop marker
+            pending = drain_log_queue()
+        log_queue.put_nowait(LOG_WRITER_STOP)
+        # A crash here has already been reported by report_log_writer_exit
+        await asyncio.gather(log_writer_task, return_exceptions=True)
+    pending += drain_log_queue()
+    if pending:
+        await write_logs(pending)
 
 # --- SECURITY CONFIG (KEEPING YOUR LOGIC) ---
 SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret_key_keep_it_safe")
 ALGORITHM = "HS256"
+# Reused for every encode/decode: one PyJWT instance, key already in bytes
+_JWT = jwt.PyJWT()
+_SECRET_BYTES = SECRET_KEY.encode()
+_ALGORITHMS = [ALGORITHM]
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 SERVER_SESSION_ID = str(uuid.uuid4())
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Only the hash is kept around; compared in constant time in /token
+EXPECTED_USER = b"admin"
+EXPECTED_PW_HASH = hashlib.sha256(b"12345").digest()
 
 app.add_middleware(
     CORSMiddleware,
@@ -117,37 +287,64 @@ app.add_middleware(
 )
 
 # --- AUTH LOGIC (KEEPING YOUR LOGIC) ---
+# Clients send the same token on every request, so only verify its signature once.
+# Restarting the server (new SERVER_SESSION_ID) still invalidates cached tokens via the sid check.
+@lru_cache(maxsize=4096)
+def decode_token(token: str) -> dict:
+    return _JWT.decode(token, _SECRET_BYTES, algorithms=_ALGORITHMS)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
+        # A cached payload skips PyJWT's own expiry check, so do it here
+        exp = payload.get("exp")
+        if exp is not None and exp <= time.time():
+            raise HTTPException(status_code=401, detail="Token expired")
         if payload.get("sid") != SERVER_SESSION_ID:
             raise HTTPException(status_code=401, detail="Session expired")
         return payload.get("sub")
+    except HTTPException:
+        raise # Keep the specific "Token expired" / "Session expired" detail
     except:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 @app.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    if form_data.username != "admin" or form_data.password != "12345":
+    # Check both fields every time (no short-circuit) so timing doesn't leak which one was wrong
+    user_ok = hmac.compare_digest(form_data.username.encode(), EXPECTED_USER)
+    pw_ok = hmac.compare_digest(hashlib.sha256(form_data.password.encode()).digest(), EXPECTED_PW_HASH)
+    if not (user_ok and pw_ok):
         raise HTTPException(status_code=400, detail="Invalid credentials")
     return {
-        "access_token": jwt.encode({"sub": form_data.username, "sid": SERVER_SESSION_ID}, SECRET_KEY, algorithm=ALGORITHM),
+        "access_token": _JWT.encode({"sub": form_data.username, "sid": SERVER_SESSION_ID}, _SECRET_BYTES, algorithm=ALGORITHM),
         "token_type": "bearer"
     }
 
+# --- PAGINATION ---
+# List endpoints use keyset pagination: pass the last id you saw to get the next page.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
 # --- PROTECTED TODO ROUTES ---
 
 @app.get("/todos", response_model=List[TodoRead]) # Use TodoRead here
-async def get_todos(user: str = Depends(get_current_user), session: Session = Depends(get_session)):
-    statement = select(Todo).options(selectinload(Todo.subTasks))
-    results = session.exec(statement).all()
+async def get_todos(
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after_id: Optional[int] = None,
+        user: str = Depends(get_current_user),
+        session: AsyncSession = Depends(get_session)
+):
+    statement = TODOS_STMT.limit(limit)
+    if after_id is not None:
+        statement = statement.where(Todo.id > after_id)
+    results = (await session.exec(statement)).unique().all() # unique() collapses the joined rows
     return results
 
 @app.post("/todos", response_model=TodoRead)
 async def add_todo(
         todo_input: TodoCreate, # Changed from Todo to TodoCreate
         user: str = Depends(get_current_user),
-        session: Session = Depends(get_session)
+        session: AsyncSession = Depends(get_session)
 ):
     # 1. Create the main Todo table object (ignore subtasks for a second)
     db_todo = Todo(
@@ -159,20 +356,17 @@ async def add_todo(
     )
 
     session.add(db_todo)
-    session.flush() # This generates the Todo ID without closing the transaction
+    await session.flush() # This generates the Todo ID without closing the transaction
 
     # 2. Create the SubTask table objects and link them to the Todo ID
     if todo_input.subTasks:
-        for st_data in todo_input.subTasks:
-            new_sub = SubTask(
-                task=st_data.task,
-                completed=st_data.completed,
-                todo_id=db_todo.id # Link it!
-            )
-            session.add(new_sub)
-
-    session.commit()
-    session.refresh(db_todo)
+        session.add_all([
+            SubTask(task=st_data.task, completed=st_data.completed, todo_id=db_todo.id) # Link it!
+            for st_data in todo_input.subTasks
+        ])
+
+    await session.commit()
+    await session.refresh(db_todo)
     return db_todo
 
 @app.put("/todos/{todo_id}", response_model=TodoRead)
@@ -180,74 +374,171 @@ async def update_todo(
         todo_id: int,
         updated_data: TodoUpdate, # Changed from Todo to TodoUpdate
         user: str = Depends(get_current_user),
-        session: Session = Depends(get_session)
+        session: AsyncSession = Depends(get_session)
 ):
-    db_todo = session.get(Todo, todo_id)
+    # Subtasks come back with the todo, ready for the diff below
+    result = await session.exec(TODO_BY_ID_STMT, params={"todo_id": todo_id})
+    db_todo = result.unique().one_or_none()
     if not db_todo:
         raise HTTPException(status_code=404, detail="Todo not found")
 
     # 1. Update basic Todo fields (task, completed, priority, etc.)
-    # .dict(exclude_unset=True) ensures we only change what was sent
-    update_dict = updated_data.dict(exclude_unset=True)
+    # exclude_unset=True ensures we only change what was sent; subtasks are synced below
+    update_dict = updated_data.model_dump(exclude_unset=True, exclude={"subTasks"})
     for key, value in update_dict.items():
-        if key != "subTasks":
-            setattr(db_todo, key, value)
-
-    # 2. Handle Subtasks (The "Clear and Replace" strategy)
-    # We delete existing subtasks first to avoid orphaned rows
-    statement = select(SubTask).where(SubTask.todo_id == todo_id)
-    existing_subtasks = session.exec(statement).all()
-    for sub in existing_subtasks:
-        session.delete(sub)
-
-    # 3. Create NEW SubTask table objects from the incoming data
-    if updated_data.subTasks:
-        for sub_data in updated_data.subTasks:
-            # We convert the SubTaskCreate object into a real SubTask table object
-            new_sub = SubTask(
-                task=sub_data.task,
-                completed=sub_data.completed,
-                todo_id=todo_id
-            )
-            session.add(new_sub)
-
-    session.add(db_todo)
-    session.commit()
-    session.refresh(db_todo)
+        setattr(db_todo, key, value)
+
+    # 2. Sync Subtasks by id so only real changes hit the database
+    existing = {sub.id: sub for sub in db_todo.subTasks}
+    new_subs = []
+    for sub_data in updated_data.subTasks:
+        sub = existing.pop(sub_data.id, None)
+        if sub is None:
+            # Unknown id (or none sent): this is a NEW subtask
+            new_subs.append(SubTask(task=sub_data.task, completed=sub_data.completed))
+        else:
+            # SQLAlchemy only emits an UPDATE if one of these actually changed
+            sub.task = sub_data.task
+            sub.completed = sub_data.completed
+
+    # 3. Whatever is left in 'existing' was removed by the client
+    if existing:
+        await session.exec(SUBTASKS_DELETE_STMT, params={"ids": list(existing)})
+        # The rows are already gone: drop them from the collection and the session without
+        # another DELETE, so a reused rowid can't collide with a stale object in the identity map
+        kept = [sub for sub in db_todo.subTasks if sub.id not in existing]
+        set_committed_value(db_todo, "subTasks", kept)
+        for sub in existing.values():
+            session.expunge(sub)
+    db_todo.subTasks.extend(new_subs) # The relationship sets todo_id on flush
+
+    await session.commit()
+    await session.refresh(db_todo)
     return db_todo
 @app.delete("/todos/{todo_id}")
-async def delete_todo(todo_id: int, user: str = Depends(get_current_user), session: Session = Depends(get_session)):
-    todo = session.get(Todo, todo_id)
+async def delete_todo(todo_id: int, user: str = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    todo = await session.get(Todo, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    session.delete(todo)
-    session.commit()
+    await session.delete(todo)
+    await session.commit()
     return {"message": "Deleted"}
 
+# --- LOG WRITER ---
+# Incoming logs are queued and written in batches: one commit for many rows
+# instead of one commit (and WAL fsync) per request.
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.05 # seconds
+LOG_QUEUE_MAXSIZE = 10_000 # POST /logs answers 503 once this many entries are waiting
+LOG_WRITER_STOP = None # Queued on shutdown to end log_writer()
+log_queue: Optional[asyncio.Queue] = None
+log_writer_task: Optional[asyncio.Task] = None
+
+def build_log_entry(data: dict) -> LogEntry:
+    # Manually create the LogEntry object.
+    # This ensures 'timestamp' is a real Python datetime object.
+    return LogEntry(
+        id=data.get("id") or new_log_id(),
+        message=data.get("message", "No message provided"),
+        stack=data.get("stack", "No stack trace"),
+        url=data.get("url", "Unknown URL"),
+        timestamp=datetime.now() # We use the server's current time
+    )
+
+async def write_logs(entries: List[LogEntry]):
+    async with async_session() as session:
+        try:
+            session.add_all(entries)
+            await session.commit()
+            return
+        except Exception as e:
+            await session.rollback()
+            print(f"CRITICAL DATABASE ERROR: {e}")
+
+    # One bad row (e.g. a duplicate id) shouldn't cost us the whole batch
+    for entry in entries:
+        async with async_session() as session:
+            try:
+                session.add(entry)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                print(f"Dropping log entry {entry.id}: {e}")
+
+def drain_log_queue() -> List[LogEntry]:
+    entries = []
+    while not log_queue.empty():
+        entry = log_queue.get_nowait()
+        if entry is not LOG_WRITER_STOP:
+            entries.append(entry)
+    return entries
+
+def report_log_writer_exit(task: asyncio.Task):
+    # Nothing restarts the writer, so at least make its death visible
+    if not task.cancelled() and task.exception() is not None:
+        print(f"CRITICAL LOG WRITER ERROR: {task.exception()!r}")
+
+async def log_writer():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        # Wait for the first entry, then keep collecting until the batch is full or the interval ends
+        entry = await log_queue.get()
+        if entry is LOG_WRITER_STOP:
+            return
+        batch = [entry]
+        deadline = loop.time() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(log_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if entry is LOG_WRITER_STOP:
+                stopping = True
+                break
+            batch.append(entry)
+        await write_logs(batch)
+
 # --- LOGGING ROUTES ---
 
 @app.get("/logs", response_model=List[LogEntry])
-async def get_logs(user: str = Depends(get_current_user), session: Session = Depends(get_session)):
-    return session.exec(select(LogEntry)).all()
-
-@app.post("/logs")
-async def create_log(data: dict, session: Session = Depends(get_session)):
+async def get_logs(
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        before_id: Optional[str] = None,
+        user: str = Depends(get_current_user),
+        session: AsyncSession = Depends(get_session)
+):
+    statement = LOGS_STMT.limit(limit)
+    if before_id is not None:
+        cursor = await session.get(LogEntry, before_id)
+        if not cursor:
+            raise HTTPException(status_code=400, detail="Unknown before_id")
+        statement = statement.where(tuple_(LogEntry.timestamp, LogEntry.id) < (cursor.timestamp, cursor.id))
+    return (await session.exec(statement)).all()
+
+@app.post("/logs", status_code=202)
+async def create_log(data: dict):
+    # Hand the entry to the background writer; it is committed with the next batch
     try:
-        # 1. Manually create the LogEntry object.
-        # This ensures 'timestamp' is a real Python datetime object.
-        new_log = LogEntry(
-            id=data.get("id") or str(uuid.uuid4())[:8],
-            message=data.get("message", "No message provided"),
-            stack=data.get("stack", "No stack trace"),
-            url=data.get("url", "Unknown URL"),
-            timestamp=datetime.now() # We use the server's current time
-        )
-
+        log_queue.put_nowait(build_log_entry(data))
+    except asyncio.QueueFull:
+        # The writer can't keep up; tell the client to back off instead of buffering without limit
+        raise HTTPException(status_code=503, detail="Log queue is full, retry later")
+    return {"status": "queued"}
+
+@app.post("/logs/critical")
+async def create_critical_log(data: dict, session: AsyncSession = Depends(get_session)):
+    # Synchronous fallback: the row is committed before we respond
+    try:
+        new_log = build_log_entry(data)
         session.add(new_log)
-        session.commit()
+        await session.commit()
         return {"status": "success"}
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         print(f"CRITICAL DATABASE ERROR: {e}")
         # Log the actual error to the console so you can see it
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,55 +1,83 @@
 import json
+import os
+import sqlite3
 from datetime import datetime
-from sqlmodel import Session, create_engine
-from main import SubTask, Todo, LogEntry # Ensure main.py is in the same folder
+from main import parse_due_date # Ensure main.py is in the same folder
+
+def to_db_datetime(value):
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if value else None
 
 def migrate():
     # 1. Load the data
     with open("db.json", "r") as f:
         data = json.load(f)
 
-    engine = create_engine("sqlite:///database.db")
+    # Plain sqlite3 + executemany: no ORM objects or dirty-checking for a bulk load.
+    # isolation_level=None so we control the transaction with BEGIN IMMEDIATE ourselves.
+    conn = sqlite3.connect("database.db", isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF") # Only for this one-off load
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
 
-    with Session(engine) as session:
         # --- MIGRATE TODOS ---
-        for t in data.get("todos", []):
-            subtasks = [SubTask(task=s["task"], completed=s["completed"]) for s in t.get("subTasks", [])]
-            new_todo = Todo(
-                task=t["task"],
-                completed=t["completed"],
-                priority=t["priority"],
-                dueDate=t.get("dueDate"),
-                remindMe=t.get("remindMe", False),
-                subTasks=subtasks
-            )
-            session.add(new_todo)
+        # We hold the write lock, so ids can be handed out up front and reused for the subtasks
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM todo").fetchone()[0] + 1
+        todo_rows = []
+        subtask_rows = []
+        for todo_id, t in enumerate(data.get("todos", []), start=next_id):
+            todo_rows.append((
+                todo_id,
+                t["task"],
+                t["completed"],
+                t["priority"],
+                to_db_datetime(parse_due_date(t.get("dueDate"))),
+                t.get("remindMe", False)
+            ))
+            subtask_rows.extend((s["task"], s["completed"], todo_id) for s in t.get("subTasks", []))
 
-        # --- MIGRATE LOGS ---
-        for l in data.get("logs", []):
-            # 1. Fix Timestamp
-            raw_ts = l.get("timestamp")
-            if isinstance(raw_ts, str):
-                l["timestamp"] = datetime.fromisoformat(raw_ts.replace('Z', '+00:00'))
-            else:
-                l["timestamp"] = datetime.now()
-
-            # 2. Fix URL (Ensure it's not None)
-            if not l.get("url"):
-                l["url"] = "Migrated / Unknown"
-
-            # 3. Fix ID: If 'id' is in the dict but it's None or empty, remove it
-            # so the model's 'default_factory' can take over.
-            if "id" in l and not l["id"]:
-                del l["id"]
+        conn.executemany(
+            'INSERT INTO todo (id, task, completed, priority, "dueDate", "remindMe") VALUES (?, ?, ?, ?, ?, ?)',
+            todo_rows
+        )
+        conn.executemany("INSERT INTO subtask (task, completed, todo_id) VALUES (?, ?, ?)", subtask_rows)
 
+        # --- MIGRATE LOGS ---
+        logs = data.get("logs", [])
+        # Draw the random bytes for every log id in one go; each id is 8 hex chars
+        spare_ids = os.urandom(4 * len(logs)).hex()
+        log_rows = []
+        for i, l in enumerate(logs):
             try:
-                new_log = LogEntry(**l)
-                session.add(new_log)
+                # 1. Fix Timestamp
+                raw_ts = l.get("timestamp")
+                if isinstance(raw_ts, str):
+                    timestamp = datetime.fromisoformat(raw_ts.replace('Z', '+00:00'))
+                else:
+                    timestamp = datetime.now()
+
+                log_rows.append((
+                    # 2. Fix ID: If 'id' is missing, None or empty, use one from the precomputed batch
+                    l.get("id") or spare_ids[i * 8:(i + 1) * 8],
+                    l["message"],
+                    l.get("stack") or "No stack trace available",
+                    # 3. Fix URL (Ensure it's not None)
+                    l.get("url") or "Migrated / Unknown",
+                    to_db_datetime(timestamp)
+                ))
             except Exception as e:
                 print(f"Skipping a bad log entry: {e}")
 
-        session.commit()
+        conn.executemany("INSERT INTO logentry (id, message, stack, url, timestamp) VALUES (?, ?, ?, ?, ?)", log_rows)
+
+        conn.execute("COMMIT")
         print("Migration successful!")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
 
 # if __name__ == "__main__":
 #     migrate()
\ No newline at end of file